@@ -39,7 +39,7 @@ except ImportError:
     GPIO = False
 
 __date__ = '2015-12-30'
-__updated__ = '2020-12-06'
+__updated__ = '2026-10-17'
 
 logger = LogStyleAdapter(logging.getLogger(__name__))
 
@@ -508,9 +508,11 @@ class PiPinsRelayHeating(BaseHeating):
         if len(self._pins) == 0:
             raise ValueError('no pins provided')
         
-        for p in self._pins:
-            if p not in range(28):
-                raise ValueError('pin number must be in range 0-27, {} given'.format(p))
+        # checking only the extremes validates the whole list in one pass
+        lowest, highest = min(self._pins), max(self._pins)
+        if lowest < 0 or highest > 27:
+            raise ValueError('pin number must be in range 0-27, {} given'
+                             .format(lowest if lowest < 0 else highest))
         
         if switch_on_level in (self.GPIO.HIGH, 'h'):
             logger.debug('setting HIGH level to switch on the heating')
@@ -19,9 +19,11 @@ You should have received a copy of the GNU General Public License
 along with Thermod.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import json
 import time
 import logging
 import asyncio
+import functools
 import jsonschema
 
 from json.decoder import JSONDecodeError
@@ -29,26 +31,27 @@ from aiohttp import web
 from aiohttp.web import json_response
 from email.utils import formatdate
 from datetime import datetime
-from urllib.parse import parse_qs
 
 from . import common
 from .common import LogStyleAdapter, ThermodStatus
 from .memento import memento
+from .timetable import json_loads
 from .heating import HeatingError
 from .thermometer import ThermometerError
 from .version import __version__ as PROGRAM_VERSION
 
 __date__ = '2017-03-19'
-__updated__ = '2020-12-06'
+__updated__ = '2026-10-17'
 __version__ = '2.4.4'
 
 baselogger = LogStyleAdapter(logging.getLogger(__name__))
 
-REQ_PATH_SETTINGS = (common.SOCKET_REQ_SETTINGS, )
-REQ_PATH_STATUS = (common.SOCKET_REQ_STATUS, )
-REQ_PATH_VERSION = (common.SOCKET_REQ_VERSION, )
-REQ_PATH_MONITOR = (common.SOCKET_REQ_MONITOR, )
-REQ_PATH_TEAPOT = ('elena', 'tea')
+# sets of accepted actions, the membership test is done on every request
+REQ_PATH_SETTINGS = frozenset((common.SOCKET_REQ_SETTINGS, ))
+REQ_PATH_STATUS = frozenset((common.SOCKET_REQ_STATUS, ))
+REQ_PATH_VERSION = frozenset((common.SOCKET_REQ_VERSION, ))
+REQ_PATH_MONITOR = frozenset((common.SOCKET_REQ_MONITOR, ))
+REQ_PATH_TEAPOT = frozenset(('elena', 'tea'))
 
 REQ_SETTINGS_ALL = common.SOCKET_REQ_SETTINGS_ALL
 REQ_SETTINGS_MODE = common.SOCKET_REQ_SETTINGS_MODE
@@ -60,6 +63,19 @@ REQ_SETTINGS_HVAC_MODE = common.SOCKET_REQ_SETTINGS_HVAC_MODE
 
 REQ_MONITOR_NAME = common.SOCKET_REQ_MONITOR_NAME
 
+# Maximum size in bytes of a request body, bigger requests are rejected
+# before being read (a full settings update is about 15 KiB).
+REQ_MAX_SIZE = 64 * 1024
+
+# Map of single settings accepted in POST requests to the corresponding
+# attributes of TimeTable.
+REQ_SETTINGS_ATTRIBUTES = {REQ_SETTINGS_MODE: 'mode',
+                           REQ_SETTINGS_T0: 't0',
+                           REQ_SETTINGS_TMIN: 'tmin',
+                           REQ_SETTINGS_TMAX: 'tmax',
+                           REQ_SETTINGS_DIFFERENTIAL: 'differential',
+                           REQ_SETTINGS_HVAC_MODE: 'hvac_mode'}
+
 RSP_MESSAGE = common.SOCKET_RSP_MESSAGE
 RSP_VERSION = common.SOCKET_RSP_VERSION
 RSP_ERROR = ThermodStatus._fields[6]
@@ -72,6 +88,40 @@ RSP_STATUS_STATUS = ThermodStatus._fields[3]
 RSP_STATUS_CURR_TEMP = ThermodStatus._fields[4]
 RSP_STATUS_TARGET_TEMP = ThermodStatus._fields[5]
 
+# Messages and JSON bodies of the responses that never change, encoded
+# only once here instead of at every response.
+_MSG_CANNOT_SAVE = 'Cannot save new settings to fileystem'
+_RSP_CANNOT_SAVE = json.dumps({
+        RSP_ERROR: _MSG_CANNOT_SAVE,
+        RSP_EXPLAIN: ('new settings accepted and applied on running Thermod '
+                      'but they cannot be saved to filesystem so, on daemon '
+                      'restart, they will be lost, try again in a couple of '
+                      'minutes')})
+
+_MSG_SHUTTING_DOWN = 'Thermod is shutting down'
+_RSP_SHUTTING_DOWN = json.dumps({RSP_ERROR: _MSG_SHUTTING_DOWN,
+                                 RSP_EXPLAIN: _MSG_SHUTTING_DOWN})
+
+_MSG_NO_SETTINGS = 'No settings provided'
+_RSP_NO_SETTINGS = json.dumps({RSP_ERROR: _MSG_NO_SETTINGS})
+
+_MSG_ALL_UPDATED = 'all settings updated'
+_RSP_ALL_UPDATED = json.dumps({RSP_MESSAGE: _MSG_ALL_UPDATED})
+
+# the explanation is the reason of web.HTTPMethodNotAllowed raised by aiohttp
+_MSG_NOT_IMPLEMENTED = 'Not Implemented'
+_RSP_NOT_IMPLEMENTED = json.dumps({RSP_ERROR: _MSG_NOT_IMPLEMENTED,
+                                   RSP_EXPLAIN: 'Method Not Allowed'})
+
+# The version of Thermod never changes while running.
+_RSP_VERSION = json.dumps({RSP_VERSION: PROGRAM_VERSION})
+
+_MSG_TEAPOT = 'I\'m a teapot'
+_RSP_TEAPOT = json.dumps({RSP_ERROR: 'To my wife',
+                          RSP_EXPLAIN: ('I dedicate this application to Elena, '
+                                        'my wife.')})
+_TEAPOT_TIMESTAMP = datetime(2017, 7, 29, 17, 0).timestamp()
+
 
 class ClientAddressLogAdapter(logging.LoggerAdapter):
     """Add client address and port to the logged messagges."""
@@ -79,9 +129,12 @@ class ClientAddressLogAdapter(logging.LoggerAdapter):
     def __init__(self, logger, client_address, extra=None):
         super().__init__(logger, extra)
         self.client_address = client_address
+        self._prefix = '{} '.format(client_address)
     
     def log(self, level, msg, *args, **kwargs):
-        self.logger.log(level, '{} {}'.format(self.client_address, msg), *args, **kwargs)
+        # the client address is added only if the message will be logged
+        if self.isEnabledFor(level):
+            self.logger.log(level, self._prefix + msg, *args, **kwargs)
 
 
 class ControlSocket(object):
@@ -103,12 +156,14 @@ class ControlSocket(object):
         if not isinstance(lock, asyncio.Condition):
             raise TypeError('the lock in ControlSocket must be an asyncio.Condition object')
         
-        self.app = web.Application(middlewares=[exceptions_handler])
+        self.app = web.Application(middlewares=[exceptions_handler],
+                                   client_max_size=REQ_MAX_SIZE)
         self.runner = web.AppRunner(self.app)
         self.host = host
         self.port = port
         
         self.app['lock'] = lock
+        self.app['save_lock'] = asyncio.Lock()
         self.app['monitors'] = asyncio.Queue()
         
         self.app['timetable'] = timetable
@@ -151,38 +206,91 @@ class ControlSocket(object):
             raise TypeError('new status for monitors must be a ThermodStatus object')
         
         baselogger.debug('updating connected monitors')
+        monitors = self.app['monitors']
         
-        if self.app['monitors'].empty():
+        if monitors.empty():
             baselogger.debug('no monitors to be updated, the queue is empty')
         else:
-            baselogger.debug('there are {} monitor(s) in the queue'.format(self.app['monitors'].qsize()))
+            baselogger.debug('there are {} monitor(s) in the queue', monitors.qsize())
         
         count = 0
-        while not self.app['monitors'].empty():
+        while not monitors.empty():
             try:
-                future = await self.app['monitors'].get()
+                # the queue is not empty, no need to wait
+                future = monitors.get_nowait()
                 if not future.cancelled():
                     future.set_result(status)
-                    baselogger.debug('monitor {} updated'.format(count))
+                    baselogger.debug('monitor {} updated', count)
                 else:
-                    baselogger.debug('monitor {} disconnected'.format(count))
+                    baselogger.debug('monitor {} disconnected', count)
             
             except asyncio.InvalidStateError:
                 baselogger.debug('cannot update monitor {} because the client '
-                                 'has probably closed the connection'.format(count))
+                                 'has probably closed the connection', count)
             
             count += 1
 
 
+@functools.lru_cache(maxsize=8)
+def _http_date(timestamp):
+    # format an integer timestamp as HTTP date, the same few timestamps
+    # (last settings update, last status change) are formatted again and
+    # again so the results are cached
+    return formatdate(timestamp, usegmt=True)
+
+
 def _last_mod_hdr(last_mod_time):
     # return a dict with the 'Last-Modified' HTTP header already formatted
-    return {'Last-Modified': formatdate(last_mod_time, usegmt=True)}
+    # (HTTP dates have a resolution of one second)
+    return {'Last-Modified': _http_date(int(last_mod_time))}
+
+
+def _settings_etag(last_mod_time):
+    # return the entity tag of the settings: the exact timestamp of their last
+    # update, weak because it's shared by plain and compressed representations
+    return 'W/"{!r}"'.format(last_mod_time)
+
+
+def _accepts_gzip(accept_encoding):
+    # check if gzip is an acceptable content-coding in 'Accept-Encoding'
+    # header: explicitly listed or matched by `*` with a non-zero q-value
+    qvalues = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        qvalue = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        
+        qvalues[coding.strip().lower()] = qvalue
+    
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    
+    return False
+
+
+def _etag_matches(etag, if_none_match):
+    # weak comparison of `etag` with the entity tags of 'If-None-Match' header
+    opaque = etag[2:]
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or (tag[2:] if tag.startswith('W/') else tag) == opaque:
+            return True
+    
+    return False
 
 
 @web.middleware
 async def exceptions_handler(request, handler):
     """Handle exceptions raised during HTTP requests."""
     logger = ClientAddressLogAdapter(baselogger, request.transport.get_extra_info('peername'))
+    request['logger'] = logger  # reused by the handlers of this request
     
     log = (logger.debug if request.method == 'GET' else logger.info)
     log('received "{} {}" request', request.method, request.url.path)
@@ -205,13 +313,19 @@ async def exceptions_handler(request, handler):
                                  data={RSP_ERROR: message,
                                        RSP_EXPLAIN: str(htnf)})
     
-    except web.HTTPMethodNotAllowed as htna:
-        message = 'Not Implemented'
-        logger.warning('Method "{}" {}', request.method, message.lower())
+    except web.HTTPMethodNotAllowed:
+        logger.warning('Method "{}" {}', request.method, _MSG_NOT_IMPLEMENTED.lower())
         response = json_response(status=501,
+                                 reason=_MSG_NOT_IMPLEMENTED,
+                                 text=_RSP_NOT_IMPLEMENTED)
+    
+    except web.HTTPRequestEntityTooLarge as htel:
+        message = 'Request Entity Too Large'
+        logger.warning('{} "{} {}" received', message.lower(), request.method, request.url.path)
+        response = json_response(status=413,
                                  reason=message,
                                  data={RSP_ERROR: message,
-                                       RSP_EXPLAIN: str(htna)})
+                                       RSP_EXPLAIN: str(htel)})
     
     except JSONDecodeError as jde:
         logger.warning('cannot update settings, the {} request contains '
@@ -256,16 +370,9 @@ async def exceptions_handler(request, handler):
         # they will be lost.
         
         logger.error('cannot save new settings to fileystem: {}', ioe)
-        message = 'Cannot save new settings to fileystem'
-        response = json_response(
-                status=423,
-                reason=message,
-                data={RSP_ERROR: message,
-                      RSP_EXPLAIN: ('new settings accepted and '
-                                    'applied on running Thermod but they '
-                                    'cannot be saved to filesystem so, on '
-                                    'daemon restart, they will be lost, '
-                                    'try again in a couple of minutes')})
+        response = json_response(status=423,
+                                 reason=_MSG_CANNOT_SAVE,
+                                 text=_RSP_CANNOT_SAVE)
     
     except asyncio.CancelledError:
         logger.debug('an asynchronous operation has been cancelled due to '
@@ -273,11 +380,9 @@ async def exceptions_handler(request, handler):
         
         # TODO if the client has already closed the connection, the response
         # is useless, find a way to separate the two behaviours.
-        message = 'Thermod is shutting down'
         response = json_response(status=530,
-                                 reason=message,
-                                 data={RSP_ERROR: message,
-                                       RSP_EXPLAIN: message})
+                                 reason=_MSG_SHUTTING_DOWN,
+                                 text=_RSP_SHUTTING_DOWN)
     
     except Exception as e:
         # this is an unhandled exception, a critical message is printed
@@ -304,6 +409,149 @@ async def exceptions_handler(request, handler):
     return response
 
 
+async def _get_version(request):
+    request['logger'].debug('preparing response with Thermod version')
+    return json_response(status=200, text=_RSP_VERSION)
+
+
+async def _get_settings(request):
+    logger = request['logger']
+    logger.debug('preparing response with Thermod settings')
+    
+    timetable = request.app['timetable']
+    
+    # No need to acquire the lock: the settings are read here without
+    # any await, so they cannot be changed by other coroutines meanwhile,
+    # and the encoded JSON is cached by the timetable itself.
+    last_updt = timetable.last_update_timestamp()
+    
+    headers = _last_mod_hdr(last_updt)
+    headers['ETag'] = _settings_etag(last_updt)
+    headers['Vary'] = 'Accept-Encoding'  # every variant, even the 304 ones
+    
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        # the entity tag has the full resolution of the update timestamp
+        not_modified = _etag_matches(headers['ETag'], if_none_match)
+    
+    else:
+        # HTTP dates have a resolution of one second, the settings are surely
+        # unchanged only if updated in a second earlier than `since` (they may
+        # have changed after a response sent in the same second)
+        since = request.if_modified_since
+        not_modified = (since is not None and int(last_updt) < since.timestamp())
+    
+    if not_modified:
+        logger.debug('settings not modified')
+        response = web.Response(status=304, headers=headers)
+    
+    elif _accepts_gzip(request.headers.get('Accept-Encoding', '')):
+        # the compressed settings are cached by the timetable too
+        headers['Content-Encoding'] = 'gzip'
+        
+        response = web.Response(status=200,
+                                headers=headers,
+                                body=timetable.compressed_settings(),
+                                content_type='application/json',
+                                charset='utf-8')
+    
+    else:
+        response = web.Response(status=200,
+                                headers=headers,
+                                body=timetable.encoded_settings(),
+                                content_type='application/json',
+                                charset='utf-8')
+    
+    return response
+
+
+async def _get_status(request):
+    logger = request['logger']
+    logger.debug('preparing response with Thermod current status')
+    
+    timetable = request.app['timetable']
+    heating = request.app['heating']
+    thermometer = request.app['thermometer']
+    
+    try:
+        async with request.app['lock']:
+            last_updt = time.time()
+            status = ThermodStatus(last_updt,
+                                   timetable.mode,
+                                   timetable.hvac_mode,
+                                   await heating.status,
+                                   timetable.degrees(await thermometer.temperature),
+                                   timetable.target_temperature(last_updt))
+    
+    except HeatingError as he:
+        message = 'Heating/Cooling Error'
+        logger.warning('{}: {} ({})', message.lower(), he,
+                       (he.suberror if he.suberror else 'no other information'))
+        
+        response = json_response(status=503,
+                                 reason=message,
+                                 data={RSP_ERROR: message,
+                                       RSP_EXPLAIN: str(he)})
+    
+    except ThermometerError as te:
+        message = 'Thermometer Error'
+        logger.warning('{}: {} ({})', message.lower(), te,
+                       (te.suberror if te.suberror else 'no other information'))
+        
+        response = json_response(status=503,
+                                 reason=message,
+                                 data={RSP_ERROR: message,
+                                       RSP_EXPLAIN: str(te)})
+    
+    else:
+        response = json_response(status=200,
+                                 headers=_last_mod_hdr(last_updt),
+                                 data=status._asdict())
+    
+    return response
+
+
+async def _get_teapot(request):
+    request['logger'].info(_MSG_TEAPOT)
+    return json_response(status=418,
+                         reason=_MSG_TEAPOT,
+                         headers=_last_mod_hdr(_TEAPOT_TIMESTAMP),
+                         text=_RSP_TEAPOT)
+
+
+async def _get_monitor(request):
+    logger = request['logger']
+    
+    # the query string is parsed (and cached) by aiohttp only here,
+    # where the name of the monitor is actually needed
+    logger.debug('enqueuing new long-polling {} monitor request',
+                 request.query.get(REQ_MONITOR_NAME, 'unknown'))
+    
+    future = asyncio.get_running_loop().create_future()
+    await request.app['monitors'].put(future)
+    
+    logger.debug('waiting for timetable status change')
+    status = await future
+    
+    # TODO feature request: create a specific class to trasfer data to
+    # monitors in order to improve monitors' functionalities.
+    logger.debug('preparing response with monitor update')
+    return json_response(status=(200 if status.error is None else 503),
+                         headers=_last_mod_hdr(status.timestamp),
+                         data=status._asdict())
+
+
+# Map of every accepted GET action to the coroutine that prepares the
+# response, so that the action is dispatched with a single lookup.
+_GET_ACTIONS = {action: coro
+                for paths, coro in ((REQ_PATH_VERSION, _get_version),
+                                    (REQ_PATH_SETTINGS, _get_settings),
+                                    (REQ_PATH_STATUS, _get_status),
+                                    (REQ_PATH_TEAPOT, _get_teapot),
+                                    (REQ_PATH_MONITOR, _get_monitor))
+                for action in paths}
+
+
 async def GET_handler(request):
     """Manage the GET requests sending back data as JSON string.
     
@@ -314,101 +562,18 @@ async def GET_handler(request):
     a monitor (the socket responds when there is a change in the status).
     """
     
-    logger = ClientAddressLogAdapter(baselogger, request.transport.get_extra_info('peername'))
+    logger = request['logger']
     logger.debug('processing "{} {}" request', request.method, request.url.path)
     
-    lock = request.app['lock']
-    timetable = request.app['timetable']
-    heating = request.app['heating']
-    thermometer = request.app['thermometer']
-    
     action = request.match_info['action']
-    qs = parse_qs(request.url.query_string)  # query string for long polling
-    
-    if action in REQ_PATH_VERSION:
-        logger.debug('preparing response with Thermod version')
-        response = json_response(status=200, data={RSP_VERSION: PROGRAM_VERSION})
-    
-    elif action in REQ_PATH_SETTINGS:
-        logger.debug('preparing response with Thermod settings')
-        
-        async with lock:
-            settings = timetable.settings()
-            last_updt = timetable.last_update_timestamp()
-        
-        response = json_response(status=200,
-                                 headers=_last_mod_hdr(last_updt),
-                                 text=settings)
-    
-    elif action in REQ_PATH_STATUS:
-        logger.debug('preparing response with Thermod current status')
-        
-        try:
-            async with lock:
-                last_updt = time.time()
-                status = ThermodStatus(last_updt,
-                                       timetable.mode,
-                                       timetable.hvac_mode,
-                                       await heating.status,
-                                       timetable.degrees(await thermometer.temperature),
-                                       timetable.target_temperature(last_updt))
-        
-        except HeatingError as he:
-            message = 'Heating/Cooling Error'
-            logger.warning('{}: {} ({})', message.lower(), he,
-                           (he.suberror if he.suberror else 'no other information'))
-            
-            response = json_response(status=503,
-                                     reason=message,
-                                     data={RSP_ERROR: message,
-                                           RSP_EXPLAIN: str(he)})
-        
-        except ThermometerError as te:
-            message = 'Thermometer Error'
-            logger.warning('{}: {} ({})', message.lower(), te,
-                           (te.suberror if te.suberror else 'no other information'))
-            
-            response = json_response(status=503,
-                                     reason=message,
-                                     data={RSP_ERROR: message,
-                                           RSP_EXPLAIN: str(te)})
-        
-        else:
-            response = json_response(status=200,
-                                     headers=_last_mod_hdr(last_updt),
-                                     data=status._asdict())
-    
-    elif action in REQ_PATH_TEAPOT:
-        message = 'I\'m a teapot'
-        logger.info(message)
-        response = json_response(
-            status=418,
-            reason=message,
-            headers=_last_mod_hdr(datetime(2017, 7, 29, 17, 0).timestamp()),
-            data={RSP_ERROR: 'To my wife',
-                  RSP_EXPLAIN: ('I dedicate this application to Elena, '
-                                'my wife.')})
-    
-    elif action in REQ_PATH_MONITOR:
-        logger.debug('enqueuing new long-polling {} monitor request',
-                     (qs[REQ_MONITOR_NAME][0] if REQ_MONITOR_NAME in qs else 'unknown'))
-        
-        future = asyncio.get_running_loop().create_future()
-        await request.app['monitors'].put(future)
-        
-        logger.debug('waiting for timetable status change')
-        status = await future
-        
-        # TODO feature request: create a specific class to trasfer data to
-        # monitors in order to improve monitors' functionalities.
-        logger.debug('preparing response with monitor update')
-        response = json_response(status=(200 if status.error is None else 503),
-                                 headers=_last_mod_hdr(status.timestamp),
-                                 data=status._asdict())
     
-    else:
+    try:
+        get_action = _GET_ACTIONS[action]
+    except KeyError:
         raise web.HTTPNotFound(reason='Invalid `{}` action in request.'.format(action))
     
+    response = await get_action(request)
+    
     logger.debug('response ready')
     return response
 
@@ -437,6 +602,10 @@ async def POST_handler(request):
         
         * `hvac_mode` to update the HVAC mode
     
+    If the request has `application/json` content type, the whole body is
+    considered as the JSON encoded settings to update the whole state, this
+    way no form decoding is required.
+    
     Any request that produces an error in updating internal settings,
     restores the old state except when the settings were correcly updated
     but they couldn't be saved to filesystem. In that situation a 423
@@ -446,7 +615,7 @@ async def POST_handler(request):
     @see thermod.timetable.TimeTable and its methods
     """
     
-    logger = ClientAddressLogAdapter(baselogger, request.transport.get_extra_info('peername'))
+    logger = request['logger']
     logger.debug('processing "{} {}" request', request.method, request.url.path)
     
     lock = request.app['lock']
@@ -455,110 +624,99 @@ async def POST_handler(request):
     
     if action in REQ_PATH_SETTINGS:
         logger.debug('parsing received POST data')
-        postvars = await request.post()
+        
+        if request.content_type == 'application/json':
+            # the body contains the whole settings, JSON decoders accept bytes
+            postvars = {REQ_SETTINGS_ALL: await request.read()}
+        else:
+            postvars = await request.post()
+        
         logger.debug('POST variables: {}', postvars)
         
+        # The single settings to be updated are collected here, outside the
+        # lock, as tuples (field, timetable attribute, new value) so that the
+        # critical section below only has to apply them.
+        updates = []
+        for var, value in postvars.items():
+            try:
+                updates.append((var, REQ_SETTINGS_ATTRIBUTES[var], value))
+            except KeyError:
+                if var != REQ_SETTINGS_ALL:
+                    logger.debug('invalid field `{}` ignored', var)
+        
+        # The whole settings are decoded before acquiring the lock, so that
+        # the critical section is not held while parsing the JSON document.
+        # Syntax errors are raised here for default handling.
+        if REQ_SETTINGS_ALL in postvars:
+            settings = json_loads(postvars[REQ_SETTINGS_ALL])
+        
         async with lock:
-            # Saving timetable state for a manual restore in case of
-            # errors during saving to filesystem or in case of errors
-            # updating more than one single setting.
-            restore_old_settings = memento(timetable)
-            
             # updating all settings
             if REQ_SETTINGS_ALL in postvars:
                 logger.debug('updating Thermod settings')
                 
-                try:
-                    timetable.load(postvars[REQ_SETTINGS_ALL])
-                    timetable.save()  # saving changes to filesystem
-                
-                except (JSONDecodeError, jsonschema.ValidationError):
-                    # No additional operation required, re-raise for default handling.
-                    raise
+                # __setstate__() is transactional and leaves the old settings
+                # in place on any error, but the new settings must also be
+                # encodable for the file (e.g. a huge number decoded as
+                # infinity is rejected only here), so the old state is saved
+                # for a manual restore. Exceptions are re-raised for default
+                # handling.
+                restore_old_settings = memento(timetable)
                 
-                except IOError:
-                    # Some settings of timetable could have been updated,
-                    # we notify this changes in order to check again the
-                    # current temperature.
-                    lock.notify_all()
-                    raise
+                try:
+                    timetable.__setstate__(settings)
+                    
+                    # JSON text to be saved, encoded while holding the lock
+                    # together with the cached JSON sent to GET requests, so
+                    # that settings that cannot be sent back are rejected
+                    data = timetable.settings(indent=2, sort_keys=True)
+                    timetable.encoded_settings()
                 
                 except Exception:
-                    # This is an unhandled exception, so we execute a
-                    # manual restore of the old settings to be sure to
-                    # leave the timetable in a valid state, then we
-                    # re-raise the exception for default handling.
                     restore_old_settings()
                     raise
                 
-                else:
-                    message = 'all settings updated'
-                    logger.info(message)
-                    response = json_response(status=200,
-                                             data={RSP_MESSAGE: message})
+                logger.info(_MSG_ALL_UPDATED)
+                response = json_response(status=200, text=_RSP_ALL_UPDATED)
             
             # updating single settings
             elif postvars:
                 logger.debug('updating one or more settings')
                 
+                # Saving timetable state for a manual restore in case of
+                # errors updating more than one single setting. The single
+                # settings never change the schedule, so the (big) `_timetable`
+                # dictionary is left out of the snapshot.
+                restore_old_settings = memento(timetable, exclude=['_timetable'])
+                
                 newvalues = {}
                 try:
-                    for var, value in postvars.items():
-                        if var == REQ_SETTINGS_MODE:
-                            timetable.mode = value
-                            newvalues[var] = timetable.mode
-                        elif var == REQ_SETTINGS_T0:
-                            timetable.t0 = value
-                            newvalues[var] = timetable.t0
-                        elif var == REQ_SETTINGS_TMIN:
-                            timetable.tmin = value
-                            newvalues[var] = timetable.tmin
-                        elif var == REQ_SETTINGS_TMAX:
-                            timetable.tmax = value
-                            newvalues[var] = timetable.tmax
-                        elif var == REQ_SETTINGS_DIFFERENTIAL:
-                            timetable.differential = value
-                            newvalues[var] = timetable.differential
-                        elif var == REQ_SETTINGS_HVAC_MODE:
-                            timetable.hvac_mode = value
-                            newvalues[var] = timetable.hvac_mode
-                        else:
-                            logger.debug('invalid field `{}` ignored', var)
-                    
                     # if no settings found in request body rise an error
-                    if len(newvalues) == 0:
+                    if len(updates) == 0:
                         raise jsonschema.ValidationError(
                                 'no valid fields found in request body',
                                 ('any settings',))
                     
-                    # saving changes to filesystem
-                    timetable.save()
-                
-                except jsonschema.ValidationError as jsve:
-                    # This exception can be raised after having successfully
-                    # updated at least one settings, so all settings must
-                    # be manually restored to the old state.
-                    
-                    logger.warning('cannot update {}: {}', list(jsve.path), jsve.message)
-                    
-                    message = 'Cannot update settings'
-                    response = json_response(
-                                    status=400,
-                                    reason=message,
-                                    data={RSP_ERROR: message,
-                                          RSP_EXPLAIN: 'Cannot update {}: {}'
-                                                       .format(list(jsve.path),
-                                                               jsve.message)})
+                    for var, attr, value in updates:
+                        setattr(timetable, attr, value)
+                        newvalues[var] = getattr(timetable, attr)
                     
-                    # restoring old settings from memento
-                    restore_old_settings()
+                    # JSON text of the new settings to be saved and cached
+                    # JSON sent to GET requests
+                    data = timetable.settings(indent=2, sort_keys=True)
+                    timetable.encoded_settings()
                 
-                except ValueError as ve:
+                except (jsonschema.ValidationError, ValueError) as err:
                     # This exception can be raised after having successfully
                     # updated at least one settings, so all settings must
                     # be manually restored to the old state.
                     
-                    logger.warning('cannot update {}: {}', var, ve)
+                    if isinstance(err, jsonschema.ValidationError):
+                        field, reason = list(err.path), err.message
+                    else:
+                        field, reason = var, err
+                    
+                    logger.warning('cannot update {}: {}', field, reason)
                     
                     message = 'Cannot update settings'
                     response = json_response(
@@ -566,18 +724,11 @@ async def POST_handler(request):
                                     reason=message,
                                     data={RSP_ERROR: message,
                                           RSP_EXPLAIN: 'Cannot update {}: {}'
-                                                        .format(var, ve)})
+                                                       .format(field, reason)})
                     
                     # restoring old settings from memento
                     restore_old_settings()
                 
-                except IOError:
-                    # Some settings of timetable could have been updated,
-                    # we notify this changes in order to immediately check
-                    # the current temperature.
-                    lock.notify_all()
-                    raise
-                
                 except Exception:
                     # This is an unhandled exception, so we execute a
                     # manual restore of the old settings to be sure to
@@ -594,15 +745,46 @@ async def POST_handler(request):
             else:  # No restore required here because no settings updated
                 logger.warning('cannot update settings, the POST request is empty')
                 
-                message = 'No settings provided'
                 response = json_response(status=400,
-                                         reason=message,
-                                         data={RSP_ERROR: message})
+                                         reason=_MSG_NO_SETTINGS,
+                                         text=_RSP_NO_SETTINGS)
             
             # If some settings of timetable have been updated, we'll notify
             # this changes in order to recheck current temperature.
             if response.status == 200:
                 lock.notify_all()
+        
+        # The new settings, already encoded under the lock, are saved to
+        # filesystem after having released the lock, so that other requests
+        # and the main loop do not wait for the disk. Only OS errors can be
+        # raised here: the settings remain applied and the IOError is reported
+        # with a 423 status code by exceptions_handler. Saves are serialized
+        # (in the same order the settings were encoded) to always have the
+        # latest settings in the file.
+        if response.status == 200:
+            async with request.app['save_lock']:
+                save = asyncio.get_running_loop().run_in_executor(
+                        None, functools.partial(timetable.save, data=data))
+                
+                try:
+                    await asyncio.shield(save)
+                
+                except asyncio.CancelledError:
+                    # The request has been cancelled (e.g. the client closed
+                    # the connection) but the executor is still writing the
+                    # file, so the save lock is held until the end of the
+                    # save, then the cancellation is propagated.
+                    while not save.done():
+                        try:
+                            await asyncio.wait((save,))
+                        except asyncio.CancelledError:
+                            pass
+                    
+                    if not save.cancelled() and save.exception() is not None:
+                        logger.error('cannot save new settings to fileystem: {}',
+                                     save.exception())
+                    
+                    raise
     
     else:
         raise web.HTTPNotFound(reason='Invalid `{}` action in request.'.format(action))
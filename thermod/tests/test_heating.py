@@ -25,9 +25,10 @@ import tempfile
 import unittest
 import aiounittest
 
-from thermod.heating import ScriptHeating, HeatingError
+from thermod import config
+from thermod.heating import ScriptHeating, PiPinsRelayHeating, HeatingError
 
-__updated__ = '2020-10-30'
+__updated__ = '2026-10-17'
 
 
 class TestHeating(aiounittest.AsyncTestCase):
@@ -172,6 +173,23 @@ exit(retcode)
         self.assertEqual(await self.heating.is_on(), True)
         self.assertEqual(await self.heating.status, 1)
         os.chmod(self.status_data,0o600)
+    
+    def test_pins_range(self):
+        config._fake_RPi_Heating = True
+        
+        try:
+            heating = PiPinsRelayHeating([0, '27'], 'h')
+            self.assertEqual(heating._pins, [0, 27])
+            
+            heating = PiPinsRelayHeating(4, 'l')
+            self.assertEqual(heating._pins, [4])
+            
+            self.assertRaises(ValueError, PiPinsRelayHeating, [], 'h')
+            self.assertRaises(ValueError, PiPinsRelayHeating, [4, 28], 'h')
+            self.assertRaises(ValueError, PiPinsRelayHeating, [-1, 4], 'h')
+        
+        finally:
+            config._fake_RPi_Heating = False
 
 
 if __name__ == "__main__":
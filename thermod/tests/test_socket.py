@@ -21,12 +21,16 @@ along with Thermod.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import copy
+import json
+import time
 import logging
 import tempfile
 import unittest
+import threading
 import asyncio
 import aiohttp
 
+from aiohttp.test_utils import make_mocked_request
 from thermod import socket, timetable, common
 from thermod.timetable import TimeTable
 from thermod.heating import BaseHeating
@@ -34,7 +38,7 @@ from thermod.socket import ControlSocket
 from thermod.thermometer import FakeThermometer
 from thermod.tests.test_timetable import fill_timetable
 
-__updated__ = '2020-12-06'
+__updated__ = '2026-10-17'
 __url_settings__ = 'http://localhost:4345/settings'
 __url_heating__ = 'http://localhost:4345/status'
 
@@ -78,12 +82,60 @@ class TestSocket(unittest.TestCase):
                 # right url
                 async with session.get(__url_settings__) as r:
                     self.assertEqual(r.status, 200)
+                    self.assertEqual(r.headers['Content-Encoding'], 'gzip')
                     settings = await r.json()
                 
                 # check returned settings
                 tt = TimeTable()
                 tt.__setstate__(settings)
                 self.assertEqual(self.timetable, tt)
+                
+                # uncompressed settings
+                async with session.get(__url_settings__, headers={'Accept-Encoding': 'identity'}) as u:
+                    self.assertEqual(u.status, 200)
+                    self.assertNotIn('Content-Encoding', u.headers)
+                    self.assertEqual(u.headers['Vary'], 'Accept-Encoding')
+                    self.assertEqual(await u.json(), settings)
+                
+                # gzip explicitly refused
+                async with session.get(__url_settings__, headers={'Accept-Encoding': 'gzip;q=0, deflate'}) as u:
+                    self.assertEqual(u.status, 200)
+                    self.assertNotIn('Content-Encoding', u.headers)
+                
+                # gzip accepted through wildcard
+                async with session.get(__url_settings__, headers={'Accept-Encoding': 'br;q=0.5, *;q=0.1'}) as u:
+                    self.assertEqual(u.status, 200)
+                    self.assertEqual(u.headers['Content-Encoding'], 'gzip')
+                
+                # conditional request with unchanged settings
+                etag = r.headers['ETag']
+                async with session.get(__url_settings__, headers={'If-None-Match': etag}) as c:
+                    self.assertEqual(c.status, 304)
+                    self.assertEqual(c.headers['ETag'], etag)
+                    self.assertEqual(c.headers['Vary'], 'Accept-Encoding')
+                    self.assertEqual(await c.read(), b'')
+                
+                # settings changed (likely in the same second of the response)
+                self.timetable.mode = timetable.JSON_MODE_OFF
+                async with session.get(__url_settings__, headers={'If-None-Match': etag}) as c:
+                    self.assertEqual(c.status, 200)
+                    self.assertNotEqual(c.headers['ETag'], etag)
+                
+                # the date of last change is not enough to detect changes
+                # in the same second
+                headers = {'If-Modified-Since': c.headers['Last-Modified']}
+                async with session.get(__url_settings__, headers=headers) as c:
+                    self.assertEqual(c.status, 200)
+                
+                # conditional request with a later date
+                headers = {'If-Modified-Since': socket._http_date(int(time.time()) + 1)}
+                async with session.get(__url_settings__, headers=headers) as c:
+                    self.assertEqual(c.status, 304)
+                
+                # conditional request with an old date
+                headers = {'If-Modified-Since': 'Sat, 29 Jul 2017 17:00:00 GMT'}
+                async with session.get(__url_settings__, headers=headers) as c:
+                    self.assertEqual(c.status, 200)
         
         self.loop.run_until_complete(this_test())
     
@@ -109,6 +161,36 @@ class TestSocket(unittest.TestCase):
         self.loop.run_until_complete(this_test())
     
     
+    def test_get_version(self):
+        async def this_test():
+            async with aiohttp.ClientSession() as session:
+                async with session.get('http://localhost:4345/version') as r:
+                    self.assertEqual(r.status, 200)
+                    self.assertEqual(await r.json(), {socket.RSP_VERSION: socket.PROGRAM_VERSION})
+        
+        self.loop.run_until_complete(this_test())
+    
+    
+    def test_monitor(self):
+        async def this_test():
+            async with aiohttp.ClientSession() as session:
+                request = asyncio.ensure_future(session.get('http://localhost:4345/monitor?name=test'))
+                
+                # waiting for the monitor to be enqueued
+                while self.socket.app['monitors'].empty():
+                    await asyncio.sleep(0.01)
+                
+                status = common.ThermodStatus(1234567890, timetable.JSON_MODE_AUTO, common.HVAC_HEATING, 0, 20.0, 21.0)
+                await self.socket.update_monitors(status)
+                self.assertTrue(self.socket.app['monitors'].empty())
+                
+                async with await request as r:
+                    self.assertEqual(r.status, 200)
+                    self.assertEqual(await r.json(), status._asdict())
+        
+        self.loop.run_until_complete(this_test())
+    
+    
     def test_post_wrong_messages(self):
         async def this_test():
             async with aiohttp.ClientSession() as session:
@@ -139,6 +221,35 @@ class TestSocket(unittest.TestCase):
                 async with session.post(__url_settings__, data={socket.REQ_SETTINGS_ALL: settings[0:30]}) as wrong:
                     self.assertEqual(wrong.status, 400)
                 
+                # number too big (decoded as infinity) restores old settings
+                old_settings = copy.deepcopy(self.timetable)
+                settings = self.timetable.__getstate__()
+                settings[timetable.JSON_TEMPERATURES][timetable.JSON_T0_STR] = 12345.6
+                settings = json.dumps(settings).replace('12345.6', '1e400')
+                async with session.post(__url_settings__, data={socket.REQ_SETTINGS_ALL: settings}) as wrong:
+                    self.assertEqual(wrong.status, 400)
+                    self.assertEqual(self.timetable, old_settings)
+                
+                async with session.get(__url_settings__) as r:
+                    self.assertEqual(r.status, 200)
+                
+                # invalid JSON body
+                async with session.post(__url_settings__, data='{"mode": "on"',
+                                        headers={'Content-Type': 'application/json'}) as wrong:
+                    self.assertEqual(wrong.status, 400)
+                
+                # request body too large
+                async with session.post(__url_settings__, data={socket.REQ_SETTINGS_ALL: ' ' * socket.REQ_MAX_SIZE}) as wrong:
+                    self.assertEqual(wrong.status, 413)
+                
+                # a valid setting followed by an invalid one is rolled back
+                old_settings = copy.deepcopy(self.timetable)
+                async with session.post(__url_settings__,
+                                        data={socket.REQ_SETTINGS_MODE: timetable.JSON_MODE_OFF,
+                                              socket.REQ_SETTINGS_DIFFERENTIAL: 1.1}) as wrong:
+                    self.assertEqual(wrong.status, 400)
+                    self.assertEqual(self.timetable, old_settings)
+                
                 # check original paramethers
                 self.assertAlmostEqual(self.timetable.differential, 0.5, delta=0.01)
                 self.assertAlmostEqual(self.timetable.tmax, 21, delta=0.01)
@@ -146,6 +257,47 @@ class TestSocket(unittest.TestCase):
         self.loop.run_until_complete(this_test())
     
     
+    def test_post_cancelled_while_saving(self):
+        started = threading.Event()
+        release = threading.Event()
+        
+        def slow_save(*args, **kwargs):
+            started.set()
+            release.wait(5)
+        
+        async def postvars():
+            return {socket.REQ_SETTINGS_MODE: timetable.JSON_MODE_OFF}
+        
+        async def this_test():
+            request = make_mocked_request('POST', '/settings',
+                                          app=self.socket.app,
+                                          match_info={'action': 'settings'})
+            request['logger'] = socket.ClientAddressLogAdapter(socket.baselogger, None)
+            request.post = postvars
+            
+            self.timetable.save = slow_save
+            handler = asyncio.ensure_future(socket.POST_handler(request))
+            
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            
+            # the save lock is held until the end of the save
+            handler.cancel()
+            await asyncio.sleep(0.1)
+            self.assertTrue(self.socket.app['save_lock'].locked())
+            
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await handler
+            
+            self.assertFalse(self.socket.app['save_lock'].locked())
+        
+        try:
+            self.loop.run_until_complete(this_test())
+        finally:
+            release.set()
+    
+    
     def test_post_right_messages(self):
         async def this_test():
             async with aiohttp.ClientSession() as session:
@@ -185,6 +337,18 @@ class TestSocket(unittest.TestCase):
                     self.assertEqual(s.status, 200)
         
                 self.assertEqual(self.timetable, tt2)  # equal after update
+                
+                # new settings saved to filesystem
+                saved = TimeTable(self.timetable.filepath)
+                self.assertEqual(saved, tt2)
+                
+                # all settings as JSON body
+                tt2.mode = timetable.JSON_MODE_ON
+                async with session.post(__url_settings__, data=tt2.settings(),
+                                        headers={'Content-Type': 'application/json'}) as j:
+                    self.assertEqual(j.status, 200)
+                
+                self.assertEqual(self.timetable, tt2)
         
         self.loop.run_until_complete(this_test())
     
@@ -194,6 +358,8 @@ class TestSocket(unittest.TestCase):
             async with aiohttp.ClientSession() as session:
                 async with session.patch(__url_settings__, data={}) as pa:
                     self.assertEqual(pa.status, 501)
+                    self.assertEqual(await pa.json(), {socket.RSP_ERROR: 'Not Implemented',
+                                                       socket.RSP_EXPLAIN: 'Method Not Allowed'})
                 
                 async with session.put(__url_settings__, data={}) as pu:
                     self.assertEqual(pu.status, 501)
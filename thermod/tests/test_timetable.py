@@ -21,6 +21,8 @@ along with Thermod.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import copy
+import gzip
+import json
 import time
 import locale
 import unittest
@@ -36,7 +38,7 @@ from thermod.common import HVAC_HEATING, HVAC_COOLING
 from thermod.timetable import TimeTable, ShouldBeOn, JsonValueError
 from thermod.heating import BaseHeating
 
-__updated__ = '2020-12-06'
+__updated__ = '2026-10-17'
 
 
 # state saved with Thermod version 1.2
@@ -492,6 +494,202 @@ class TestTimeTable(aiounittest.AsyncTestCase):
         os.remove(filepath2)
     
     
+    def test_save_atomic(self):
+        (file1, filepath1) = tempfile.mkstemp(suffix='.tmp', prefix='thermod')
+        os.close(file1)
+        os.chmod(filepath1, 0o640)
+        
+        fill_timetable(self.timetable)
+        self.timetable.save(filepath1)
+        
+        # the old file is replaced keeping its permissions
+        self.assertEqual(os.stat(filepath1).st_mode & 0o777, 0o640)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(filepath1))
+                          if name.startswith('.{}.'.format(os.path.basename(filepath1)))], [])
+        self.assertEqual(TimeTable(filepath1), self.timetable)
+        
+        with open(filepath1, 'r') as file:
+            old_content = file.read()
+        
+        # an invalid state doesn't touch the old file
+        self.timetable._differential = float('nan')
+        self.assertRaises(ValueError, self.timetable.save, filepath1)
+        
+        with open(filepath1, 'r') as file:
+            self.assertEqual(file.read(), old_content)
+        
+        os.remove(filepath1)
+    
+    
+    def test_save_concurrent(self):
+        with tempfile.TemporaryDirectory(prefix='thermod') as dirpath:
+            filepath = os.path.join(dirpath, 'timetable.json')
+            
+            fill_timetable(self.timetable)
+            other = copy.deepcopy(self.timetable)
+            other.mode = timetable.JSON_MODE_OFF
+            
+            def save(tt):
+                for _ in range(20):
+                    tt.save(filepath)
+            
+            threads = [threading.Thread(target=save, args=(tt,))
+                       for tt in (self.timetable, other)]
+            
+            for thread in threads:
+                thread.start()
+            
+            for thread in threads:
+                thread.join()
+            
+            # no temporary file left and the file has one of the two timetables
+            self.assertEqual(os.listdir(dirpath), ['timetable.json'])
+            self.assertIn(TimeTable(filepath), (self.timetable, other))
+    
+    
+    def test_json_loads(self):
+        self.assertEqual(timetable.json_loads('{"a": [1, 2.5, "t0"]}'), {'a': [1, 2.5, 't0']})
+        self.assertEqual(timetable.json_loads(b'{"a": null}'), {'a': None})
+        
+        # same exceptions with or without orjson module
+        self.assertRaises(JsonValueError, timetable.json_loads, '{"a": NaN}')
+        self.assertRaises(JsonValueError, timetable.json_loads, '[Infinity]')
+        self.assertRaises(json.JSONDecodeError, timetable.json_loads, '{"a": 1')
+        
+        # integers out of the 64-bit range are not converted to floats
+        for data in ('[12345678901234567890123]', b'[-9223372036854775809]'):
+            with self.subTest(data=data):
+                result = timetable.json_loads(data)
+                self.assertEqual(result, json.loads(data))
+                self.assertIsInstance(result[0], int)
+    
+    
+    def test_settings_invalid_float(self):
+        fill_timetable(self.timetable)
+        self.timetable._differential = float('nan')  # not rejected by the schema
+        
+        self.assertRaises(ValueError, self.timetable.settings)
+        self.assertRaises(ValueError, self.timetable.encoded_settings)
+        
+        # same behaviour without orjson module
+        _orjson = timetable.orjson
+        timetable.orjson = False
+        
+        try:
+            self.assertRaises(ValueError, self.timetable.settings)
+            self.assertRaises(ValueError, self.timetable.encoded_settings)
+        
+        finally:
+            timetable.orjson = _orjson
+    
+    
+    def test_settings_null(self):
+        fill_timetable(self.timetable)
+        
+        # additional properties with null value are accepted by the schema
+        state = self.timetable.__getstate__()
+        state[timetable.JSON_TEMPERATURES]['comment'] = None
+        self.timetable.__setstate__(state)
+        
+        encoded = self.timetable.encoded_settings()
+        self.assertIsNone(json.loads(encoded)[timetable.JSON_TEMPERATURES]['comment'])
+        
+        # same result without orjson module
+        _orjson = timetable.orjson
+        timetable.orjson = False
+        
+        try:
+            self.assertEqual(timetable._json_dumps_state(self.timetable.__getstate__()), encoded)
+        
+        finally:
+            timetable.orjson = _orjson
+    
+    
+    def test_settings_surrogate(self):
+        fill_timetable(self.timetable)
+        
+        # lone surrogates are accepted by the schema but are not valid UTF-8
+        state = self.timetable.__getstate__()
+        state[timetable.JSON_TEMPERATURES]['comment'] = '\ud800'
+        self.timetable.__setstate__(state)
+        
+        _orjson = timetable.orjson
+        timetable.orjson = False
+        
+        try:
+            encoded = self.timetable.encoded_settings()
+            self.assertEqual(json.loads(encoded)[timetable.JSON_TEMPERATURES]['comment'], '\ud800')
+            self.assertEqual(json.loads(self.timetable.settings()), json.loads(encoded))
+        
+        finally:
+            timetable.orjson = _orjson
+    
+    
+    def test_settings_not_orjson_encodable(self):
+        fill_timetable(self.timetable)
+        
+        # additional properties accepted by the schema that orjson
+        # cannot encode: too deep nesting and lone surrogates
+        deep = {}
+        inner = deep
+        for _ in range(300):
+            inner['x'] = {}
+            inner = inner['x']
+        
+        for value in (deep, '\ud800'):
+            with self.subTest(value=type(value).__name__):
+                settings = self.timetable.__getstate__()
+                settings[timetable.JSON_TEMPERATURES]['extra'] = value
+                self.timetable.__setstate__(settings)
+                
+                encoded = self.timetable.encoded_settings()
+                self.assertEqual(json.loads(encoded), self.timetable.__getstate__())
+    
+    
+    def test_settings_cache(self):
+        fill_timetable(self.timetable)
+        
+        settings = self.timetable.settings()
+        self.assertIs(self.timetable.settings(), settings)
+        
+        # any change of settings discards the cached JSON
+        self.timetable.mode = timetable.JSON_MODE_OFF
+        self.assertNotEqual(self.timetable.settings(), settings)
+        self.assertEqual(json.loads(self.timetable.settings())[timetable.JSON_MODE],
+                         timetable.JSON_MODE_OFF)
+        
+        settings = self.timetable.settings()
+        self.timetable.update(3, 15, 0, 34)
+        self.assertNotEqual(self.timetable.settings(), settings)
+        
+        # an invalid change leaves the cached JSON untouched
+        settings = self.timetable.settings()
+        self.assertRaises(JsonValueError, self.timetable.update, 7, 11, 1, 'invalid')
+        self.assertEqual(self.timetable.settings(), settings)
+        
+        # other formats are not cached
+        self.assertEqual(json.loads(self.timetable.settings(indent=2, sort_keys=True)),
+                         json.loads(settings))
+        self.assertIs(self.timetable.settings(), settings)
+        
+        # encoded settings follow the same cache
+        encoded = self.timetable.encoded_settings()
+        self.assertEqual(encoded, settings.encode('utf-8'))
+        self.assertIs(self.timetable.encoded_settings(), encoded)
+        
+        # and so the compressed ones
+        compressed = self.timetable.compressed_settings()
+        self.assertEqual(gzip.decompress(compressed), encoded)
+        self.assertIs(self.timetable.compressed_settings(), compressed)
+        self.timetable.mode = timetable.JSON_MODE_ON
+        self.assertIsNot(self.timetable.compressed_settings(), compressed)
+        
+        self.timetable.tmax = 30
+        self.assertNotEqual(self.timetable.encoded_settings(), encoded)
+        self.assertEqual(self.timetable.encoded_settings(),
+                         self.timetable.settings().encode('utf-8'))
+    
+    
     def test_equality_and_copy_operators(self):
         tt = TimeTable()
         
@@ -46,7 +46,7 @@ except ImportError:
         MCP3008 = False
 
 __date__ = '2016-02-04'
-__updated__ = '2020-12-08'
+__updated__ = '2026-10-17'
 
 logger = LogStyleAdapter(logging.getLogger(__name__))
 
@@ -492,6 +492,10 @@ class PiAnalogZeroThermometer(BaseThermometer):
         
         # voltage reference value
         self._vref = ((3.32/(3.32+7.5))*3.3*1000)
+        
+        # The TMP36 output is 10 mV/°C with an offset of 500 mV, the
+        # conversion factor is computed once here and not at every reading.
+        self._factor = self._vref / 10
             
         # If the config variable '_fake_RPi_Thermometer' is True, fake
         # implementation for MCP3008 class is used in order to test
@@ -513,7 +517,7 @@ class PiAnalogZeroThermometer(BaseThermometer):
             _MCP3008 = MCP3008
         
         logger.debug('init A/D converter with channels {}', channels)
-        self._adc = [_MCP3008(channel=c) for c in channels]
+        self._adc = tuple(_MCP3008(channel=c) for c in channels)
         
         # Set max comunication speed with the SPI device.
         # It's enough to set only for first MCP3008 object because every
@@ -566,7 +570,8 @@ class PiAnalogZeroThermometer(BaseThermometer):
         """
         
         logger.debug('retrieving temperatures from A/D converter')
-        temperatures = [(((adc.value * self._vref) - 500) / 10) for adc in self._adc]
+        factor = self._factor
+        temperatures = [(adc.value * factor) - 50 for adc in self._adc]
         
         logger.debug('checking standard deviation of temperatures {}', temperatures)
         
@@ -20,8 +20,12 @@ along with Thermod.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import os
+import re
+import gzip
 import json
+import shutil
 import logging
+import tempfile
 import jsonschema
 import time
 import math
@@ -29,14 +33,18 @@ import calendar
 
 from copy import deepcopy
 from datetime import datetime
-from json.decoder import JSONDecodeError
 
 from .memento import transactional
 from .common import LogStyleAdapter, ThermodStatus, JsonValueError, \
     HVAC_HEATING, HVAC_COOLING, HVAC_ALL_MODES
 
+try:
+    import orjson
+except ImportError:
+    orjson = False
+
 __date__ = '2015-09-09'
-__updated__ = '2021-11-10'
+__updated__ = '2026-10-17'
 
 logger = LogStyleAdapter(logging.getLogger(__name__))
 
@@ -129,6 +137,22 @@ JSON_SCHEMA = {
                          'h10', 'h11', 'h12', 'h13', 'h14', 'h15', 'h16', 'h17', 'h18', 'h19',
                          'h20', 'h21', 'h22', 'h23']}}}
 
+# The validator is built and checked only once, then reused for every
+# validation instead of being recreated by each `jsonschema.validate()` call.
+_JSON_VALIDATOR_CLASS = jsonschema.validators.validator_for(JSON_SCHEMA)
+_JSON_VALIDATOR_CLASS.check_schema(JSON_SCHEMA)
+_JSON_VALIDATOR = _JSON_VALIDATOR_CLASS(JSON_SCHEMA)
+
+
+def json_validate(settings):
+    """Validate `settings` against the timetable JSON schema.
+    
+    @exception jsonschema.ValidationError if `settings` are not valid
+    """
+    
+    error = jsonschema.exceptions.best_match(_JSON_VALIDATOR.iter_errors(settings))
+    if error is not None:
+        raise error
 
 
 def is_valid_temperature(temperature):
@@ -270,6 +294,84 @@ def json_reject_invalid_float(value):
                          '`NaN` and `Infinity` are not accepted')
 
 
+# Shared encoder for compact JSON settings (the states returned by
+# `TimeTable.__getstate__()` are newly created trees without cycles).
+_JSON_COMPACT_ENCODER = json.JSONEncoder(ensure_ascii=False,
+                                         check_circular=False,
+                                         allow_nan=False,
+                                         separators=(',', ':'))
+
+# Same encoder escaping non-ASCII characters, used for strings that cannot be
+# encoded as UTF-8 (lone surrogates are accepted by the JSON schema).
+_JSON_COMPACT_ASCII_ENCODER = json.JSONEncoder(ensure_ascii=True,
+                                               check_circular=False,
+                                               allow_nan=False,
+                                               separators=(',', ':'))
+
+
+def _json_dumps_state(state):
+    """Encode a timetable `state` as compact UTF-8 JSON.
+    
+    If the module `orjson` is available it's used as a faster encoder. It
+    encodes `NaN` and `Infinity` as `null` instead of failing, so when `null`
+    is found in its output (it can also be a genuine `None` value or part of
+    a string) the state is encoded again with the standard encoder, that
+    fails only on real `NaN` and `Infinity`. The standard encoder is used
+    also for states that `orjson` cannot encode at all (nesting deeper than
+    255 levels, lone surrogates in strings). Strings that cannot be encoded
+    as UTF-8 (lone surrogates) are escaped as ASCII.
+    
+    @exception ValueError if there is a `NaN` or `Infinity` in `state`
+    """
+    
+    if orjson:
+        try:
+            data = orjson.dumps(state)
+        except orjson.JSONEncodeError:
+            pass
+        else:
+            if b'null' not in data:
+                return data
+    
+    try:
+        return _JSON_COMPACT_ENCODER.encode(state).encode('utf-8')
+    except UnicodeEncodeError:
+        return _JSON_COMPACT_ASCII_ENCODER.encode(state).encode('ascii')
+
+
+# Runs of digits long enough to be an integer out of the 64-bit range.
+_JSON_LONG_DIGITS = re.compile('[0-9]{19}')
+_JSON_LONG_DIGITS_BYTES = re.compile(b'[0-9]{19}')
+
+
+def json_loads(data):
+    """Decode the JSON `data` (string or bytes) rejecting `NaN` and `Infinity`.
+    
+    If the module `orjson` is available it's used as a faster decoder. It
+    doesn't accept anything the standard `json` module would reject, so on
+    any error the standard decoder is executed to raise the same exceptions.
+    However `orjson` converts integers out of the 64-bit range to floats,
+    losing precision, thus the standard decoder is used for any `data`
+    containing 19 or more consecutive digits, this way the result is always
+    the same of the standard `json` module.
+    
+    @exception JSONDecodeError if `data` is not valid JSON
+    @exception thermod.common.JsonValueError if `data` contains `NaN`
+        or `Infinity`
+    """
+    
+    long_digits = (_JSON_LONG_DIGITS_BYTES if isinstance(data, (bytes, bytearray))
+                   else _JSON_LONG_DIGITS)
+    
+    if orjson and not long_digits.search(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    
+    return json.loads(data, parse_constant=json_reject_invalid_float)
+
+
 
 class ShouldBeOn(int):
     """Behaves as a boolean with a `ThermodStatus` attribute.
@@ -347,6 +449,19 @@ class TimeTable(object):
         to current timestamp of last settings change.
         """
         
+        self._settings_cache = None
+        """Cached JSON string returned by `TimeTable.settings()`.
+        
+        Reset to `None` by `TimeTable._set_updated()` whenever the settings
+        change, so the JSON is encoded again only after a change.
+        """
+        
+        self._encoded_settings_cache = None
+        """Cached bytes returned by `TimeTable.encoded_settings()`."""
+        
+        self._compressed_settings_cache = None
+        """Cached bytes returned by `TimeTable.compressed_settings()`."""
+        
         self.filepath = filepath
         """Full path to a JSON timetable configuration file."""
         
@@ -425,6 +540,18 @@ class TimeTable(object):
         return new
     
     
+    def _set_updated(self, timestamp=None):
+        """Record a change of settings at `timestamp` (default to now).
+        
+        The cached JSON settings are discarded too.
+        """
+        
+        self._last_update_timestamp = time.time() if timestamp is None else timestamp
+        self._settings_cache = None
+        self._encoded_settings_cache = None
+        self._compressed_settings_cache = None
+    
+    
     def _old_state_adapter(self, oldstate):
         """Adapt a state saved with Thermod version 1.x to match the new JSON schema.
         
@@ -491,7 +618,7 @@ class TimeTable(object):
         try:
             # always validating returning state
             logger.debug('performing validation')
-            jsonschema.validate(settings, JSON_SCHEMA)
+            json_validate(settings)
         
         except jsonschema.ValidationError:
             logger.debug('the timetable is invalid')
@@ -528,7 +655,7 @@ class TimeTable(object):
         
         try:
             logger.debug('performing validation on new state')
-            jsonschema.validate(_state, JSON_SCHEMA)
+            json_validate(_state)
             
             logger.debug('assigning new value to each setting')
             self._mode = _state[JSON_MODE]
@@ -541,7 +668,7 @@ class TimeTable(object):
             if JSON_HVAC_MODE in _state:
                 self._hvac_mode = _state[JSON_HVAC_MODE]
             
-            self._last_update_timestamp = time.time()
+            self._set_updated()
             
             # the state here is valid
             self._has_been_validated = True
@@ -594,18 +721,55 @@ class TimeTable(object):
         return self._has_been_validated
     
     
-    def settings(self, indent=0, sort_keys=False):
+    def settings(self, indent=None, sort_keys=False):
         """Get internal settings as JSON string.
         
+        With default arguments the JSON string is compact and it is cached
+        and reused until the next change of settings.
+        
         @exception ValueError if there is an invalid float in internal settings
         """
         
+        if indent is None and not sort_keys:
+            if self._settings_cache is None:
+                self._settings_cache = self.encoded_settings().decode('utf-8')
+            
+            return self._settings_cache
+        
         return json.dumps(self.__getstate__(),
                           indent=indent,
                           sort_keys=sort_keys,
                           allow_nan=False)
     
     
+    def encoded_settings(self):
+        """Get internal settings as compact UTF-8 encoded JSON.
+        
+        The bytes are cached and reused until the next change of settings.
+        
+        @exception ValueError if there is an invalid float in internal settings
+        """
+        
+        if self._encoded_settings_cache is None:
+            self._encoded_settings_cache = _json_dumps_state(self.__getstate__())
+        
+        return self._encoded_settings_cache
+    
+    
+    def compressed_settings(self):
+        """Get internal settings as gzip compressed UTF-8 encoded JSON.
+        
+        The bytes are cached and reused until the next change of settings.
+        
+        @exception ValueError if there is an invalid float in internal settings
+        """
+        
+        if self._compressed_settings_cache is None:
+            self._compressed_settings_cache = gzip.compress(self.encoded_settings(), 6)
+        
+        return self._compressed_settings_cache
+    
+    
     # no need for @transactional because __setstate__ is @transactionl
     def load(self, settings):
         """Update internal state loading settings from JSON string.
@@ -619,7 +783,7 @@ class TimeTable(object):
             raised during storing of new settings
         """
         
-        self.__setstate__(json.loads(settings, parse_constant=json_reject_invalid_float))
+        self.__setstate__(json_loads(settings))
     
     
     # no need for @transactional because __setstate__ is @transactionl
@@ -651,29 +815,32 @@ class TimeTable(object):
         # loading json file
         with open(self.filepath, 'r') as file:
             logger.debug('loading json file: {}', self.filepath)
-            settings = json.load(file, parse_constant=json_reject_invalid_float)
+            settings = json_loads(file.read())
         
         self.__setstate__(settings)
-        self._last_update_timestamp = os.path.getmtime(self.filepath)
+        self._set_updated(os.path.getmtime(self.filepath))
         
         logger.debug('timetable (re)loaded')
     
     
-    def save(self, filepath=None):
+    def save(self, filepath=None, data=None):
         """Save the current timetable to JSON file.
         
         Save the current configuration of the timetable to the file
         pointed by `filepath` parameter (full path to file). If `filepath` is
         `None`, settings are saved to the internal TimeTable.filepath.
         
+        If `data` is provided, it must be the JSON text previously returned by
+        `settings(indent=2, sort_keys=True)` and it is saved in place of the
+        current settings, this way the file can be written without holding
+        any lock on the timetable and only OS errors can be raised.
+        
         @exception ValueError if there is a 'NaN' or 'Infinite' float in internal settings
         @exception RuntimeError if no timetable JSON file is provided
         @exception jsonschema.ValidationError if internal settings are invalid
         @exception OSError if the file cannot be written or other OS related errors
         """
         
-        # TODO this method is huge if executed on slow platform, try to execute async.
-        
         logger.debug('saving timetable to file')
         
         if filepath is None:
@@ -683,35 +850,58 @@ class TimeTable(object):
             logger.debug('filepath not set, cannot save timetable')
             raise RuntimeError('no timetable file provided, cannot save data')
         
-        # validate and retrive settings
-        settings = self.__getstate__()
+        # The JSON is fully encoded (and validated) before touching the
+        # filesystem, if not already provided, then it's written to a
+        # temporary file that atomically replaces the old one, thus the
+        # old file is never left half-written in case of errors.
+        if data is None:
+            data = self.settings(indent=2, sort_keys=True)
         
-        # if an old JSON file exists, load its content for later restore if necessary
-        try:
-            logger.debug('reading old JSON file {}', filepath)
-            with open(filepath, 'r') as file:
-                old_settings = json.load(file, parse_constant=json_reject_invalid_float)
-        
-        except FileNotFoundError:
-            logger.debug('old JSON file does not exist, skipping')
-            old_settings = None
+        filepath = os.path.realpath(filepath)  # replace the target of a symlink
+        dirpath, filename = os.path.split(filepath)
         
-        except JSONDecodeError:
-            logger.debug('old JSON file is invalid, it will be overwritten')
-            old_settings = None
+        try:
+            # the temporary file has a unique name, so concurrent saves
+            # never write to the same file
+            (fd, tmppath) = tempfile.mkstemp(suffix='.tmp',
+                                             prefix='.{}.'.format(filename),
+                                             dir=dirpath)
+        
+        except PermissionError:
+            # the directory is not writable, the old file is overwritten
+            logger.debug('cannot create temporary file in {}, overwriting '
+                         'JSON file {}', dirpath, filepath)
+            
+            with open(filepath, 'w') as file:
+                file.write(data)
         
-        # save JSON settings
-        with open(filepath, 'w') as file:
+        else:
             try:
-                logger.debug('saving timetable to JSON file {}', file.name)
-                json.dump(settings, file, indent=2, sort_keys=True, allow_nan=False)
+                with open(fd, 'w') as file:
+                    logger.debug('saving timetable to temporary JSON file {}', tmppath)
+                    file.write(data)
+                    
+                    # the new content must be on disk before replacing the
+                    # old file, otherwise a power loss can leave it empty
+                    file.flush()
+                    os.fsync(file.fileno())
+                
+                try:
+                    shutil.copymode(filepath, tmppath)
+                except FileNotFoundError:
+                    logger.debug('old JSON file does not exist, permissions '
+                                 'of temporary file used')
+                
+                logger.debug('replacing JSON file {}', filepath)
+                os.replace(tmppath, filepath)
             
             except:
                 logger.debug('cannot save new settings to filesystem')
                 
-                if old_settings:
-                    logger.debug('restoring old settings')
-                    json.dump(old_settings, file, indent=2, sort_keys=True, allow_nan=False)
+                try:
+                    os.remove(tmppath)
+                except OSError:
+                    pass
                 
                 raise
         
@@ -746,7 +936,7 @@ class TimeTable(object):
                     self._mode))
         
         self._mode = mode.lower()
-        self._last_update_timestamp = time.time()
+        self._set_updated()
         logger.debug('new mode set: {}', self._mode)
     
     
@@ -777,7 +967,7 @@ class TimeTable(object):
                 'it must be a number in range [0;1]'.format(value))
         
         self._differential = nvalue
-        self._last_update_timestamp = time.time()
+        self._set_updated()
         logger.debug('new differential value set: {}', nvalue)
     
     
@@ -805,7 +995,7 @@ class TimeTable(object):
         
         self._hvac_mode = value
         
-        self._last_update_timestamp = time.time()
+        self._set_updated()
         logger.debug('new hvac mode set: {}', self._hvac_mode)
     
     
@@ -833,7 +1023,7 @@ class TimeTable(object):
                 'is invalid, it must be a number'.format(value))
         
         self._temperatures[JSON_T0_STR] = nvalue
-        self._last_update_timestamp = time.time()
+        self._set_updated()
         logger.debug('new t0 temperature set: {}', nvalue)
     
     
@@ -861,7 +1051,7 @@ class TimeTable(object):
                 'is invalid, it must be a number'.format(value))
         
         self._temperatures[JSON_TMIN_STR] = nvalue
-        self._last_update_timestamp = time.time()
+        self._set_updated()
         logger.debug('new tmin temperature set: {}', nvalue)
     
     
@@ -889,7 +1079,7 @@ class TimeTable(object):
                 'is invalid, it must be a number'.format(value))
         
         self._temperatures[JSON_TMAX_STR] = nvalue
-        self._last_update_timestamp = time.time()
+        self._set_updated()
         logger.debug('new tmax temperature set: {}', nvalue)
     
     
@@ -943,7 +1133,7 @@ class TimeTable(object):
         
         # update timetable
         self._timetable[_day][_hour][_quarter] = _temp
-        self._last_update_timestamp = time.time()
+        self._set_updated()
         
         logger.debug('timetable updated: day "{}", hour "{}", quarter "{}", '
                      'temperature "{}"', _day, _hour, _quarter, _temp)